@@ -0,0 +1,295 @@
+import os
+import re
+import sys
+import json
+import time
+import pathlib
+from collections import ChainMap
+from concurrent.futures import ProcessPoolExecutor
+
+import fix_header
+from fix_header import (PrintError, PrintInfo, ReadJson, GetBaseConfig, GetPluginConfig, FindUProjectFile, FindPluginPath,
+                        GetPluginModules, BuildExternalIndex, LoadEngineIndex, BuildHeaderLookups, GenerateFileList,
+                        IterFileList, GetFilePath, GetDisplayPath, readFile, StripComment, ShouldIgnoreFile,
+                        ProcessSourceRawLines, ProcessHeaderRawLines, IsLineInclude, ProcessInclude, GetIncludeName)
+
+# Type names a file declares, including forward declarations
+DECLARATION_PATTERN = r'^\s*(?:class|struct|enum(?:\s+class)?)\s+(?:\w+_API\s+)?(\w+)'
+IDENTIFIER_PATTERN = r'\b[A-Z]\w*\b'
+
+# Unreal type prefixes. AActor lives in Actor.h, FVector in Vector.h, and so on
+TYPE_PREFIXES = "UAFIETS"
+
+
+def scan_file(path, extension, cname):
+    """Parse a file in a worker process: its includes in order, the type names it uses and the ones it declares.
+
+    returns None for the files the lint leaves alone: ignored ones and ones with a malformed custom include block
+    """
+    rawLines = readFile(path)
+    if len(rawLines) > 0 and ShouldIgnoreFile(rawLines[0]):
+        return None
+
+    if extension == "cpp":
+        success, copyright, pch, includes, custom_includes, code = ProcessSourceRawLines(rawLines)
+        if pch:
+            includes = [pch] + includes
+    else:
+        success, copyright, includes, custom_includes, genheader, code = ProcessHeaderRawLines(rawLines)
+
+    if not success:
+        return None
+
+    # Custom blocks come after the sorted includes. Their includes may be indented under an #if
+    includes = includes + [line.strip() for line in custom_includes if IsLineInclude(line.strip())]
+
+    used = set()
+    declared = set()
+    for line in code:
+        line = StripComment(line)
+        m = re.match(DECLARATION_PATTERN, line)
+        if m:
+            declared.add(m.group(1))
+        used.update(re.findall(IDENTIFIER_PATTERN, line))
+
+    return {"includes": includes, "used": used - declared, "size": os.path.getsize(path)}
+
+
+def resolve_include(include):
+    """Returns (cname, is_user_header) for a known header, None otherwise."""
+    include, user_code = ProcessInclude(include)
+    cname = GetIncludeName(include)
+    if cname is None:
+        return None
+    if user_code or cname in fix_header.engineHeaders:
+        return cname, user_code
+    return None
+
+
+def get_header_candidates(identifier):
+    yield identifier
+    if len(identifier) > 2 and identifier[0] in TYPE_PREFIXES and identifier[1].isupper():
+        yield identifier[1:]
+
+
+def get_engine_header_size(cname):
+    info = fix_header.engineHeaders[cname]
+    try:
+        return os.path.getsize("%s/%s/%s.h" % (info.rootdir, info.module_path, info.cname))
+    except OSError:
+        return 0
+
+
+class IncludeGraph:
+    """Resolved include graph of the plugin's own headers."""
+
+    def __init__(self, headers, scans):
+        self.user_includes = {}
+        self.engine_includes = {}
+        self.sizes = {}
+        self.closures = {}
+        self.dependencies = {}
+
+        for cname, scan in scans.items():
+            resolved = [include for include in map(resolve_include, scan["includes"]) if include]
+            self.user_includes[cname] = [name for name, user_code in resolved if user_code]
+            self.engine_includes[cname] = [name for name, user_code in resolved if not user_code]
+            self.sizes[cname] = scan["size"]
+
+            # Plugin headers whose types this header uses
+            self.dependencies[cname] = set()
+            for identifier in scan["used"]:
+                for candidate in get_header_candidates(identifier):
+                    if candidate in headers and candidate != cname:
+                        self.dependencies[cname].add(candidate)
+
+    def closure(self, cname):
+        """All the plugin headers reachable from a header, itself included."""
+        if cname in self.closures:
+            return self.closures[cname]
+
+        visited = set()
+        stack = [cname]
+        while stack:
+            current = stack.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            stack.extend(self.user_includes.get(current, []))
+
+        self.closures[cname] = visited
+        return visited
+
+    def closure_of(self, cnames):
+        result = set()
+        for cname in cnames:
+            result |= self.closure(cname)
+        return result
+
+    def missing_dependencies(self, cname):
+        """Plugin headers a header needs but doesn't include, directly or indirectly."""
+        return self.dependencies.get(cname, set()) - self.closure(cname)
+
+    def engine_reach(self, user_headers, engine_headers):
+        """The engine headers included directly by a set of files and every plugin header they reach."""
+        result = set(engine_headers)
+        for cname in self.closure_of(user_headers):
+            result.update(self.engine_includes.get(cname, []))
+        return result
+
+
+def find_non_self_contained(files, graph):
+    """Find the plugin headers that compile only because of the includes placed before them.
+
+    returns {header: {relied on header: [files]}}
+    """
+    findings = {}
+    for path, resolved in files:
+        preceding = set()
+        for cname, user_code in resolved:
+            if not user_code:
+                continue
+
+            for dependency in graph.missing_dependencies(cname) & preceding:
+                findings.setdefault(cname, {}).setdefault(dependency, []).append(path)
+            preceding |= graph.closure(cname)
+
+    return findings
+
+
+def audit_source(cname, resolved, graph, pch_headers):
+    """Check that a source file includes its own header first.
+
+    returns the problem and the estimated preprocessing bytes saved by fixing it, or None
+    """
+    names = [name for name, user_code in resolved]
+    if not cname in names:
+        return "does not include its own header", 0
+
+    position = names.index(cname)
+    leading = resolved[:position]
+    if all(name in pch_headers for name, user_code in leading):
+        return None
+
+    # Once the header is first, anything only the leading includes pull in is up for removal
+    rest = resolved[position:]
+    rest_user = [name for name, user_code in rest if user_code]
+    keep = graph.closure_of(rest_user) | graph.closure_of(graph.missing_dependencies(cname))
+    leading_user = [name for name, user_code in leading if user_code]
+    saved = sum(graph.sizes.get(name, 0) for name in graph.closure_of(leading_user) - keep)
+
+    keep_engine = graph.engine_reach(keep, [name for name, user_code in rest if not user_code])
+    for name, user_code in leading:
+        if not user_code and not name in keep_engine:
+            saved += get_engine_header_size(name)
+
+    return "first include is %s.h, expected %s.h" % (names[0], cname), saved
+
+
+def print_usage():
+    print("Usage: python audit_includes.py <SolutionDir> <CurrentFileDir> [--rebuild-index]")
+
+
+def audit_includes(solution_dir, current_file_dir, rebuild_index=False):
+    """Audit the include order and header self-containment of a whole plugin."""
+    base_config = GetBaseConfig()
+    if not base_config:
+        PrintError("cannot find base config file. aborting..")
+        sys.exit(1)
+
+    uproject_file = FindUProjectFile(solution_dir)
+    if not uproject_file:
+        PrintError("Cannot find uproject file")
+        sys.exit(1)
+
+    engine_version = ReadJson(uproject_file)["EngineAssociation"]
+    if not engine_version in base_config["engine_path"]:
+        PrintError("Unsupported engine version: %s" % engine_version)
+        sys.exit(1)
+
+    plugin_path = FindPluginPath(current_file_dir)
+    plugin_config = GetPluginConfig(plugin_path)
+    fix_header.WHITELIST_PATHS = plugin_config.get("whitelist_includes", [])
+    fix_header.IGNORE_FILES = plugin_config.get("ignore_files", [])
+    report_format = plugin_config.get("report_format", "console")
+    fix_header.REPORT_FORMAT = report_format
+    pch_headers = plugin_config.get("pch_headers", [])
+    PrintInfo("Plugin: " + plugin_path.name)
+
+    engine_index = LoadEngineIndex(engine_version, base_config["engine_path"][engine_version], base_config.get("preferred_paths", []), rebuild_index)
+    fix_header.engineHeaders = ChainMap(BuildExternalIndex(solution_dir, plugin_config), engine_index)
+
+    sources = {}
+    for module_dir in GetPluginModules(plugin_path, plugin_config):
+        for subdir in ["Public", "Private"]:
+            GenerateFileList("%s/%s" % (module_dir, subdir), "h", fix_header.userHeaders)
+            for info in IterFileList("%s/%s" % (module_dir, subdir), "cpp"):
+                sources.setdefault(info.cname, info)
+    BuildHeaderLookups()
+
+    files = [(info, "h") for info in fix_header.userHeaders.values()] + [(info, "cpp") for info in sources.values()]
+    PrintInfo("Scanning %d files" % len(files))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor() as executor:
+        scans = list(executor.map(scan_file,
+                                  [GetFilePath(info, extension) for info, extension in files],
+                                  [extension for info, extension in files],
+                                  [info.cname for info, extension in files],
+                                  chunksize=16))
+
+    # Leave out the files the lint skips
+    scanned = [(file, scan) for file, scan in zip(files, scans) if scan is not None]
+    skipped = len(files) - len(scanned)
+
+    header_scans = {info.cname: scan for (info, extension), scan in scanned if extension == "h"}
+    graph = IncludeGraph(fix_header.userHeaders, header_scans)
+
+    resolved_files = []
+    source_findings = []
+    for (info, extension), scan in scanned:
+        path = GetDisplayPath(info, extension)
+        resolved = [include for include in map(resolve_include, scan["includes"]) if include]
+        resolved_files.append((path, resolved))
+
+        if extension == "cpp" and info.cname in fix_header.userHeaders:
+            finding = audit_source(info.cname, resolved, graph, pch_headers)
+            if finding:
+                source_findings.append((path, finding[0], finding[1]))
+
+    header_findings = find_non_self_contained(resolved_files, graph)
+    elapsed = time.perf_counter() - start
+
+    source_findings.sort(key=lambda finding: -finding[2])
+    for path, problem, saved in source_findings:
+        if report_format == "json":
+            print(json.dumps({"file": path, "problem": problem, "estimated_bytes_saved": saved}))
+        else:
+            print("[%s] %s (up to %d bytes less to preprocess)" % (path, problem, saved))
+
+    for cname, relied_on in sorted(header_findings.items()):
+        path = GetDisplayPath(fix_header.userHeaders[cname], "h")
+        if report_format == "json":
+            print(json.dumps({"file": path, "problem": "not self-contained", "relies_on": {name + ".h": sorted(set(users)) for name, users in relied_on.items()}}))
+        else:
+            details = ", ".join("%s.h (before it in %d files)" % (name, len(set(users))) for name, users in sorted(relied_on.items()))
+            print("[%s] is not self-contained, relies on %s" % (path, details))
+
+    bytes_saved = sum(finding[2] for finding in source_findings)
+    if report_format == "json":
+        print(json.dumps({"summary": {"files_audited": len(scanned), "files_skipped": skipped, "seconds": round(elapsed, 3),
+                                      "misplaced_own_header": len(source_findings), "not_self_contained": len(header_findings),
+                                      "estimated_bytes_saved": bytes_saved}}))
+    else:
+        print("Audited %d files (%d ignored or malformed) in %.2fs: %d sources with a misplaced own header, %d headers not self-contained, up to %d bytes saved"
+              % (len(scanned), skipped, elapsed, len(source_findings), len(header_findings), bytes_saved))
+
+
+if __name__ == "__main__":
+    rebuild_index = "--rebuild-index" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--rebuild-index"]
+    if len(argv) < 3:
+        print_usage()
+        sys.exit(1)
+
+    audit_includes(pathlib.Path(argv[1]), pathlib.Path(argv[2]), rebuild_index)
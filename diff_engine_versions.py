@@ -0,0 +1,154 @@
+import sys
+import time
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import fix_header
+from fix_header import (PrintError, ReadJson, GetBaseConfig, GetPluginConfig, FindUProjectFile, FindPluginPath,
+                        GetPluginModules, BuildExternalIndex, EnsureEngineIndex, MappedHeaderIndex, IterFileList,
+                        GetFilePath, GetDisplayPath, readPreamble, IsLineInclude, IsWhitelisted, GetIncludeName,
+                        FormatInclude, HeaderLookup)
+
+
+def load_indexes(base_config, versions, rebuild=False):
+    """Build the missing or outdated engine indexes, one worker process per version, and map them all."""
+    preferred_paths = base_config.get("preferred_paths", [])
+    with ProcessPoolExecutor(max_workers=len(versions)) as executor:
+        futures = [executor.submit(EnsureEngineIndex, version, base_config["engine_path"][version], preferred_paths, rebuild)
+                   for version in versions]
+        return [MappedHeaderIndex(future.result()) for future in futures]
+
+
+def diff_indexes(old_index, new_index):
+    """Compare two engine indexes. Returns the sets of added, removed and moved header names."""
+    old_names = set(old_index)
+    new_names = set(new_index)
+
+    added = new_names - old_names
+    removed = old_names - new_names
+    moved = {name for name in old_names & new_names if old_index[name].dir != new_index[name].dir}
+    return added, removed, moved
+
+
+def collect_plugin_includes(module_dirs):
+    """Yield (file, include) for every include in the preamble of the plugin's headers and sources."""
+    for module_dir in module_dirs:
+        for subdir in ["Public", "Private"]:
+            for extension in ["h", "cpp"]:
+                for info in IterFileList("%s/%s" % (module_dir, subdir), extension):
+                    lines, _ = readPreamble(GetFilePath(info, extension), extension)
+                    for line in lines:
+                        if IsLineInclude(line):
+                            yield GetDisplayPath(info, extension), line
+
+
+def find_upgrade_impact(includes, local_headers, old_index, new_index, removed, moved):
+    """Find the plugin includes that the upgrade would rewrite, and the ones it would break."""
+    rewritten = []
+    broken = []
+    old_lookup = HeaderLookup(old_index)
+    new_lookup = HeaderLookup(new_index)
+    local_lower = {name.lower() for name in local_headers}
+
+    for path, include in includes:
+        if IsWhitelisted(include):
+            continue
+
+        cname = GetIncludeName(include)
+        if cname is None or cname in local_headers:
+            continue
+
+        if not cname in old_index:
+            # Resolve includes with the wrong case the way the lint repairs them
+            if cname.lower() in local_lower:
+                continue
+            info = old_lookup.FindIgnoreCase(cname)
+            if info is None:
+                continue
+            cname = info.cname
+
+        if cname in removed:
+            suggestions = [FormatInclude(info) for score, info in new_lookup.FindSimilar(cname, 3, 0.5)]
+            broken.append((path, include, suggestions))
+        elif cname in moved:
+            # The lint only rewrites includes that don't already use the new path
+            new_include = FormatInclude(new_index[cname])
+            if include != new_include:
+                rewritten.append((path, include, new_include))
+
+    return rewritten, broken
+
+
+def print_usage():
+    print("Usage: python diff_engine_versions.py <SolutionDir> <CurrentFileDir> <TargetVersion> [<SourceVersion>] [--rebuild-index]")
+
+
+def diff_engine_versions(solution_dir, current_file_dir, target_version, source_version=None, rebuild_index=False):
+    """Report how upgrading the plugin from one engine version to another affects its includes."""
+    base_config = GetBaseConfig()
+    if not base_config:
+        PrintError("cannot find base config file. aborting..")
+        sys.exit(1)
+
+    if source_version is None:
+        uproject_file = FindUProjectFile(solution_dir)
+        if not uproject_file:
+            PrintError("Cannot find uproject file")
+            sys.exit(1)
+        source_version = ReadJson(uproject_file)["EngineAssociation"]
+
+    for version in [source_version, target_version]:
+        if not version in base_config["engine_path"]:
+            PrintError("Unsupported engine version: %s" % version)
+            sys.exit(1)
+
+    plugin_path = FindPluginPath(current_file_dir)
+    plugin_config = GetPluginConfig(plugin_path)
+    fix_header.WHITELIST_PATHS = plugin_config.get("whitelist_includes", [])
+    fix_header.IGNORE_FILES = plugin_config.get("ignore_files", [])
+    print("Plugin: " + plugin_path.name)
+    print("Engine: %s -> %s" % (source_version, target_version))
+
+    start = time.perf_counter()
+    old_index, new_index = load_indexes(base_config, [source_version, target_version], rebuild_index)
+    print("Loaded engine indexes [%d -> %d Headers] in %.2fs" % (len(old_index), len(new_index), time.perf_counter() - start))
+
+    start = time.perf_counter()
+    added, removed, moved = diff_indexes(old_index, new_index)
+    print("Engine headers: %d added, %d removed, %d moved [%.3fs]" % (len(added), len(removed), len(moved), time.perf_counter() - start))
+
+    # Headers of the plugin and its dependencies don't change with the engine
+    module_dirs = GetPluginModules(plugin_path, plugin_config)
+    local_headers = set(BuildExternalIndex(solution_dir, plugin_config))
+    for module_dir in module_dirs:
+        for subdir in ["Public", "Private"]:
+            local_headers.update(info.cname for info in IterFileList("%s/%s" % (module_dir, subdir), "h"))
+
+    includes = collect_plugin_includes(module_dirs)
+    rewritten, broken = find_upgrade_impact(includes, local_headers, old_index, new_index, removed, moved)
+
+    if rewritten:
+        print("\nIncludes that would be rewritten [%d]:" % len(rewritten))
+        for path, include, new_include in rewritten:
+            print("  [%s] %s -> %s" % (path, include, new_include))
+
+    if broken:
+        print("\nIncludes that would break [%d]:" % len(broken))
+        for path, include, suggestions in broken:
+            print("  [%s] %s" % (path, include))
+            if suggestions:
+                print("      Did you mean: " + ", ".join(suggestions))
+
+    if not rewritten and not broken:
+        print("No plugin includes are affected by the upgrade")
+
+
+if __name__ == "__main__":
+    rebuild_index = "--rebuild-index" in sys.argv
+    argv = [arg for arg in sys.argv if arg != "--rebuild-index"]
+    if len(argv) < 4:
+        print_usage()
+        sys.exit(1)
+
+    source = argv[4] if len(argv) > 4 else None
+    diff_engine_versions(pathlib.Path(argv[1]), pathlib.Path(argv[2]), argv[3], source, rebuild_index)
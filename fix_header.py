@@ -4,9 +4,16 @@ import re
 import sys
 import pathlib
 from subprocess import call
-from collections import namedtuple
+from collections import namedtuple, deque, Counter, ChainMap
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import json
 import atexit
+import hashlib
+import mmap
+import struct
+import tempfile
+import time
 from datetime import datetime
 
 class bcolors:
@@ -23,7 +30,12 @@ class bcolors:
 
 
 def PrintError(ErrorMessage):
-    print(bcolors.BOLD + bcolors.FAIL + "Error: " + bcolors.ENDC + ErrorMessage)
+    PrintInfo(bcolors.BOLD + bcolors.FAIL + "Error: " + bcolors.ENDC + ErrorMessage)
+
+
+# Progress and error messages. They go to stderr in json mode so stdout stays machine readable
+def PrintInfo(message):
+    print(message, file=sys.stderr if REPORT_FORMAT == "json" else sys.stdout, flush=True)
 
 
 def ReadJson(filename):
@@ -48,8 +60,37 @@ def GetPluginConfig(PluginPath):
     return data
 
 
+def FindUProjectFile(SolutionDir):
+    for file in SolutionDir.glob("*.uproject"):
+        return file
+    return None
+
+
+def FindPluginPath(CurrentFileDir):
+    PluginPath = CurrentFileDir
+    while PluginPath != PluginPath.parent:
+        if PluginPath.parent.name == "GameFeatures" or PluginPath.parent.name == "Plugins":
+            break
+        PluginPath = PluginPath.parent
+    return PluginPath
+
+
+def GetPluginModules(PluginPath, PluginConfig):
+    ModuleList = []
+
+    if "plugin_modules" in PluginConfig:
+        for ModuleName in PluginConfig["plugin_modules"]:
+            ModuleList.append(PluginPath / "Source" / ModuleName)
+    else:
+        for ModuleDir in PluginPath.glob("Source/*"):
+            ModuleList.append(ModuleDir)
+
+    return ModuleList
+
+
 def PrintUsage():
-    print("Usage: %s <SolutionDir> <CurrentFileDir>" % os.path.basename(__file__))
+    print("Usage: %s <SolutionDir> <CurrentFileDir> [--rebuild-index]" % os.path.basename(__file__))
+    print("  --rebuild-index  rebuild the cached engine header index even if it looks up to date")
 
 
 def check_filenames(directory, max_length):
@@ -94,100 +135,28 @@ class DebugLogger:
         if not self.file.closed:
             self.log("Debug logging ended")
             self.file.close()
-            print(f"Debug information has been written to {self.filename}")
+            PrintInfo(f"Debug information has been written to {self.filename}")
 
 
 ########################################################################
-debug_logger = DebugLogger()
-SolutionDir = pathlib.Path(sys.argv[1])
-
-for file in SolutionDir.glob("*.uproject"):
-    UPROJECT_FILE = file
-    break
-
-if not UPROJECT_FILE:
-    print("Cannot find uproject file")
-    sys.exit();
-
-UProjectJson = ReadJson(UPROJECT_FILE)
-ENGINE_VERSION = UProjectJson["EngineAssociation"]
-print("Engine: " + ENGINE_VERSION)
-
-CurrentFileDir = pathlib.Path(sys.argv[2])
-
-PluginPath = CurrentFileDir
-while PluginPath != PluginPath.parent:
-    if PluginPath.parent.name == "GameFeatures" or PluginPath.parent.name == "Plugins":
-        break
-    PluginPath = PluginPath.parent
-
-if not PluginPath.parent:
-    PrintError("Cannot find plugin path")
-    sys.exit();
-
-print("Plugin: " + PluginPath.name)
-
-if len(sys.argv) < 3:
-    PrintUsage()
-    sys.exit()
-
-# grab the script config
-BaseConfig = GetBaseConfig()
-if not BaseConfig:
-    PrintError("cannot find base config file. aborting..")
-    sys.exit()
-
-preferred_paths = BaseConfig.get("preferred_paths", [])
-
-# grab the plugin config
-PluginConfig = GetPluginConfig(PluginPath)
-ScriptEnabled = PluginConfig.get("enabled", False)
-
-if not ScriptEnabled:
-    PrintError("Header lint is not enabled in this module")
-    sys.exit()
-
-if not ENGINE_VERSION in BaseConfig["engine_path"]:
-    PrintError("Unsupported engine version: %s" % ENGINE_VERSION)
-    sys.exit()
-
-# Configuration
-ENGINE_SOURCE = BaseConfig["engine_path"][ENGINE_VERSION]
-COPYRIGHT_NOTICE = BaseConfig["copyright"]
-WHITELIST_PATHS = PluginConfig.get("whitelist_includes", [])
-IGNORE_FILES = PluginConfig.get("ignore_files", [])
-###
-
-if not COPYRIGHT_NOTICE:
-    PrintError("copyright not provided in base configuration")
-    sys.exit()
-
-## Init the directory list
-enginedirs = [
-    "%s/Runtime" % ENGINE_SOURCE,
-    "%s/Editor" % ENGINE_SOURCE]
-
-ModuleList = []
-
-if "plugin_modules" in PluginConfig:
-    for ModuleName in PluginConfig["plugin_modules"]:
-        ModuleList.append(PluginPath / "Source" / ModuleName)
-else:
-    for ModuleDir in PluginPath.glob("Source/*"):
-        ModuleList.append(ModuleDir)
-
-print("Modules: " + ", ".join([x.name for x in ModuleList]))
-
-rootdirs = ModuleList
-# for ModuleName in ModuleList:
-#	rootdirs.append("%s/%s" % (PLUGIN_SOURCE, ModuleName))
-
+# Lint configuration. Populated by main() from the base and plugin configs
+COPYRIGHT_NOTICE = ""
+WHITELIST_PATHS = []
+IGNORE_FILES = []
+REPORT_FORMAT = "console"
 
 FileInfo = namedtuple("FileInfo", "rootdir dir cname module_path")
 userHeaders = {}
 engineHeaders = {}
 
 
+def GetIncludePath(include):
+    m = re.search('#include \"(.*)\"', include)
+    if m:
+        return m.group(1)
+    return None
+
+
 def IsWhitelisted(include):
     pattern = '#include \"(.*)\"'
     m = re.search(pattern, include)
@@ -198,10 +167,89 @@ def IsWhitelisted(include):
     return False
 
 
-def ProcessInclude(include):
-    if IsWhitelisted(include):
-        return include, False
-
+def GetTrigrams(name):
+    padded = "$%s$" % name.lower()
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class HeaderLookup:
+    # Secondary indexes over a cname -> FileInfo map, for includes that don't match a cname
+    # exactly. Both indexes are built on first use, after the header map has been populated
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.maps = headers.maps if isinstance(headers, ChainMap) else [headers]
+        self.lower = None
+        self.trigrams = None
+        self.trigram_counts = None
+        self.similar = {}
+
+    def FindIgnoreCase(self, cname):
+        if self.lower is None:
+            # Mapped indexes have a lowercase name table of their own, searched in place
+            self.lower = []
+            for headers in self.maps:
+                lower = None
+                if not isinstance(headers, MappedHeaderIndex):
+                    lower = {}
+                    for name in headers:
+                        lower.setdefault(name.lower(), name)
+                self.lower.append(lower)
+
+        # Maps are searched in precedence order, like an exact lookup
+        for headers, lower in zip(self.maps, self.lower):
+            if lower is None:
+                info = headers.FindIgnoreCase(cname)
+            else:
+                name = lower.get(cname.lower())
+                info = None if name is None else headers[name]
+            if info is not None:
+                return info
+        return None
+
+    # returns [(score, info)] of the closest names, best first
+    def FindSimilar(self, cname, max_results, min_score):
+        # Results are memoized, so callers get a copy they are free to change
+        key = (cname, max_results, min_score)
+        if key in self.similar:
+            return list(self.similar[key])
+
+        if self.trigrams is None:
+            self.trigrams = {}
+            self.trigram_counts = {}
+            for name in self.headers:
+                trigrams = GetTrigrams(name)
+                self.trigram_counts[name] = len(trigrams)
+                for trigram in trigrams:
+                    self.trigrams.setdefault(trigram, []).append(name)
+
+        query = GetTrigrams(cname)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.trigrams.get(trigram, []))
+
+        results = []
+        for name, count in shared.items():
+            score = count / (len(query) + self.trigram_counts[name] - count)
+            if score >= min_score:
+                results.append((score, name))
+
+        results.sort(key=lambda result: (-result[0], result[1]))
+        self.similar[key] = [(score, self.headers[name]) for score, name in results[:max_results]]
+        return list(self.similar[key])
+
+
+userLookup = HeaderLookup(userHeaders)
+engineLookup = HeaderLookup(engineHeaders)
+
+
+def BuildHeaderLookups():
+    global userLookup, engineLookup
+    userLookup = HeaderLookup(userHeaders)
+    engineLookup = HeaderLookup(engineHeaders)
+
+
+def GetIncludeName(include):
     pattern_dir = '#include \".*/(.*).h\"'
     pattern_simple = '#include \"(.*).h\"'
 
@@ -210,9 +258,38 @@ def ProcessInclude(include):
         m = re.search(pattern_simple, include)
 
     if not m:
+        return None
+    return m.group(1)
+
+
+def FormatInclude(info):
+    if len(info.dir) == 0:
+        return '#include \"%s.h\"' % info.cname
+    return '#include \"%s/%s.h\"' % (info.dir, info.cname)
+
+
+# returns info, bUserCode. info is None if the header is unknown
+def FindHeaderIgnoreCase(cname):
+    info = userLookup.FindIgnoreCase(cname)
+    if info is not None:
+        return info, True
+    return engineLookup.FindIgnoreCase(cname), False
+
+
+def ProcessInclude(include):
+    if IsWhitelisted(include):
         return include, False
 
-    cname = m.group(1)
+    cname = GetIncludeName(include)
+    if cname is None:
+        return include, False
+
+    if not cname in userHeaders and not cname in engineHeaders:
+        # Includes with the wrong case compile on Windows but break case sensitive file systems
+        info, bUserCode = FindHeaderIgnoreCase(cname)
+        if info is None:
+            return include, False
+        return FormatInclude(info), bUserCode
 
     if not cname in userHeaders:
         # This is probably an engine header. Try to fix it from the engine header metadata
@@ -233,7 +310,16 @@ def ProcessInclude(include):
     return include, True
 
 
-def ProcessIncludes(base_includes):
+def GetIncludeGroup(include, groups):
+    path = GetIncludePath(include)
+    if path is not None:
+        for index, group in enumerate(groups):
+            if path.startswith(group):
+                return index
+    return len(groups)
+
+
+def ProcessIncludes(base_includes, groups=[]):
     user_includes = []
     engine_includes = []
 
@@ -244,8 +330,9 @@ def ProcessIncludes(base_includes):
         else:
             engine_includes.append(include)
 
-    user_includes.sort()
-    engine_includes.sort()
+    # Includes are sorted within their group, and groups keep the order they were configured in
+    user_includes.sort(key=lambda include: (GetIncludeGroup(include, groups), include))
+    engine_includes.sort(key=lambda include: (GetIncludeGroup(include, groups), include))
 
     result = []
 
@@ -315,23 +402,43 @@ def AreLinesEqual(linesA, linesB):
     return True
 
 
-# returns success, pch, includes[], custom_includes[], code[]
-def ProcessSourceRawLines(rawLines, cname):
+def IsLinePragmaOnce(line):
+    return line.strip() == '#pragma once'
+
+
+def IsLineCoreMinimal(line):
+    return line.strip() == '#include \"CoreMinimal.h\"'
+
+
+# Lines that may appear before the code starts. Anything else ends the include preamble
+def IsPreambleLine(line, extension):
+    if IsLineEmpty(line) or IsLineCopyright(line) or IsLineInclude(line):
+        return True
+    if extension == "h":
+        return IsLinePragmaOnce(line) or IsLineCoreMinimal(line)
+    return False
+
+
+def EnsureLineEnding(rawLines):
+    # Make sure we have a line ending
+    if len(rawLines) > 0 and len(rawLines[-1]) > 0:
+        rawLines.append("")
+
+
+# returns success, copyright, pch, includes[], custom_includes[], code[]
+def ProcessSourceRawLines(rawLines):
     code = []
     includes = []
     custom_includes = []
+    copyright = None
     pch = ""
     bFoundPCH = False
 
-    # Make sure we have a line ending
-    if len(rawLines) > 0 and len(rawLines[-1]) > 0:
-        rawLines.append("")
-
     bCustomHeaderBlock = False;
     bProcessingHeader = True
     for rawLine in rawLines:
 
-        if IsCustomHeaderBlockComment(rawLine):
+        if bProcessingHeader and IsCustomHeaderBlockComment(rawLine):
             bCustomHeaderBlock = not bCustomHeaderBlock
             custom_includes.append(rawLine)
             continue
@@ -341,67 +448,33 @@ def ProcessSourceRawLines(rawLines, cname):
 
         if not bCustomHeaderBlock:
             if bProcessingHeader:
-                if IsLineEmpty(rawLine):
-                    continue
+                if not IsPreambleLine(rawLine, "cpp"):
+                    bProcessingHeader = False;
                 elif IsLineCopyright(rawLine):
-                    continue
+                    if copyright is None:
+                        copyright = rawLine
                 elif IsLineInclude(rawLine):
                     if not bFoundPCH:
                         bFoundPCH = True
                         pch = rawLine
                     else:
                         includes.append(rawLine)
-                else:
-                    bProcessingHeader = False;
 
         if not bProcessingHeader:
             code.append(rawLine)
-            if IsLineInclude(rawLine):
-                print("WARN: Include not processed: %s.cpp" % cname)
 
-    Success = True
-    if bCustomHeaderBlock:
-        print("WARN: Malformed custom include block. %s.cpp" % cname)
-        Success = False
-
-    return Success, pch, includes, custom_includes, code
+    # An unterminated custom include block is malformed
+    Success = not bCustomHeaderBlock
+    return Success, copyright, pch, includes, custom_includes, code
 
 
 def ShouldIgnoreFile(first_line):
     return first_line.startswith('//~')
 
 
-def ProcessSourceFile(info):
-    filePath = "%s/%s/%s.cpp" % (info.rootdir, info.dir, info.cname)
-    # print("Source:", info.cname)
-
-    rawLines = readFile(filePath)
-
-    if len(rawLines) > 0 and ShouldIgnoreFile(rawLines[0]):
-        return False
-
-    success, pch, base_includes, custom_includes, code = ProcessSourceRawLines(rawLines, info.cname)
-    if not success:
-        return False
-
-    includes = []
-    includes.append(ProcessInclude(pch)[0])
-    includes.append("")
-    includes.extend(ProcessIncludes(base_includes))
-    includes.extend(custom_includes)
-
-    lines = []
-    lines.append(COPYRIGHT_NOTICE)
-    lines.append("")
-    lines.extend(includes)
-    lines.append("")
-    lines.extend(code)
-
-    if AreLinesEqual(rawLines, lines):
-        return False
+def GetFilePath(info, extension):
+    return "%s/%s/%s.%s" % (info.rootdir, info.dir, info.cname, extension)
 
-    writeFile(filePath, lines)
-    return True
 
 def HasUObjectMacros(rawLines):
     # Check if any line contains UCLASS(, USTRUCT(, or UENUM(
@@ -412,22 +485,18 @@ def HasUObjectMacros(rawLines):
     return False
 
 
-# returns success, includes[], custom_includes[], genheader, code[]
-def ProcessHeaderRawLines(rawLines, cname):
+# returns success, copyright, includes[], custom_includes[], genheader, code[]
+def ProcessHeaderRawLines(rawLines):
     code = []
     includes = []
     custom_includes = []
+    copyright = None
     genheader = None
-    needs_generated = HasUObjectMacros(rawLines)
-
-    # Make sure we have a line ending
-    if len(rawLines) > 0 and len(rawLines[-1]) > 0:
-        rawLines.append("")
 
     bCustomHeaderBlock = False;
     bProcessingHeader = True
     for rawLine in rawLines:
-        if IsCustomHeaderBlockComment(rawLine):
+        if bProcessingHeader and IsCustomHeaderBlockComment(rawLine):
             bCustomHeaderBlock = not bCustomHeaderBlock
             custom_includes.append(rawLine)
             continue
@@ -437,44 +506,23 @@ def ProcessHeaderRawLines(rawLines, cname):
 
         if not bCustomHeaderBlock:
             if bProcessingHeader:
-                if IsLineEmpty(rawLine):
-                    continue
+                if not IsPreambleLine(rawLine, "h"):
+                    bProcessingHeader = False
                 elif IsLineCopyright(rawLine):
-                    continue
-                elif rawLine.strip() == '#pragma once':
-                    continue
-                elif rawLine.strip() == '#include \"CoreMinimal.h\"':
-                    continue
-                elif IsLineInclude(rawLine):
+                    if copyright is None:
+                        copyright = rawLine
+                elif IsLineInclude(rawLine) and not IsLineCoreMinimal(rawLine):
                     if rawLine.strip().endswith(".generated.h\""):
                         genheader = rawLine
-                        needs_generated = False
                     else:
                         includes.append(rawLine)
-                else:
-                    bProcessingHeader = False
 
         if not bProcessingHeader:
             code.append(rawLine)
-            if IsLineInclude(rawLine):
-                print("WARN: Include not processed: %s.h" % cname)
 
-    Success = True
-    if bCustomHeaderBlock:
-        print("WARN: Malformed custom include block. %s.cpp" % cname)
-        Success = False
-
-    # If we need a generated header but don't have one, create it
-    if needs_generated and not genheader:
-        for line in rawLines:
-            if ".generated.h" in line:
-                needs_generated = False
-                break
-
-        if needs_generated:
-            genheader = f'#include "{cname}.generated.h"'
-
-    return Success, includes, custom_includes, genheader, code
+    # An unterminated custom include block is malformed
+    Success = not bCustomHeaderBlock
+    return Success, copyright, includes, custom_includes, genheader, code
 
 
 def StripComment(line):
@@ -493,45 +541,408 @@ def ValidateHeaderRawLines(rawLines, filename):
         if m:
             params = m.group(2)
             if params.lower().find('category') == -1:
-                print("Blueprint access doesn't have a category. [{}.h:{}] {}".format(filename, i + 1, line))
+                yield "Blueprint access doesn't have a category. [{}.h:{}] {}".format(filename, i + 1, line)
 
 
-def ProcessHeaderFile(info):
-    filePath = "%s/%s/%s.h" % (info.rootdir, info.dir, info.cname)
-    # print("Header:", info.cname)
+########################################################################
+# Lint rules
+#
+# Every check and rewrite is a rule registered in LINT_RULES and enabled from the "rules"
+# section of header_lint.json. A rule is either switched on/off with a bool, or configured
+# with a dict of options:
+#
+#   "rules": {
+#       "blueprint_category": false,
+#       "banned_includes": {"includes": ["Engine.h", "EngineMinimal.h"]},
+#       "sort_includes": {"groups": ["GameFramework/", "Components/"]}
+#   }
+#
+# A rule's scope tells the scanner how much of a file it needs. When none of the enabled
+# rules need the body of a file, only its include preamble is read from disk
+
+SCOPE_PREAMBLE = "preamble"
+SCOPE_BODY = "body"
+SCOPE_PLUGIN = "plugin"
+
+LINT_RULES = {}
+
+
+def RegisterRule(RuleClass):
+    LINT_RULES[RuleClass.name] = RuleClass
+    return RuleClass
+
+
+class LintRule:
+    name = None
+    scope = SCOPE_PREAMBLE
+    extensions = ["h", "cpp"]
+    default_enabled = True
+
+    def __init__(self, options):
+        self.options = options
+        self.cpu_time = 0.0
+
+    # Rewrites and/or reports on a single file
+    def Apply(self, doc):
+        pass
+
+    # Runs once per plugin, after all the files have been processed
+    def CheckPlugin(self, PluginPath):
+        pass
+
+
+class LintDocument:
+    def __init__(self, info, extension, rawLines, complete=True):
+        self.info = info
+        self.extension = extension
+        self.rawLines = rawLines
+        # False if only the include preamble (and the first line of code) was read
+        self.complete = complete
+        self.copyright = None
+        self.pch = ""
+        self.includes = []
+        self.custom_includes = []
+        self.genheader = None
+        self.code = []
+        self.diagnostics = []
+
+    def Report(self, message):
+        self.diagnostics.append(message)
+
+
+@RegisterRule
+class CopyrightRule(LintRule):
+    name = "copyright"
+
+    def Apply(self, doc):
+        doc.copyright = COPYRIGHT_NOTICE
+
+
+@RegisterRule
+class SortIncludesRule(LintRule):
+    name = "sort_includes"
+
+    def Apply(self, doc):
+        groups = self.options.get("groups", [])
+        if doc.extension == "cpp":
+            doc.pch = ProcessInclude(doc.pch)[0]
+        doc.includes = ProcessIncludes(doc.includes, groups)
+
+
+@RegisterRule
+class UnresolvedIncludesRule(LintRule):
+    # Reports includes that match no known header, with the closest header names. Includes
+    # with no close match at all (third party code, engine plugins) are left alone. Off by
+    # default: engine plugin headers aren't indexed, so their suggestions are often wrong
+    name = "unresolved_includes"
+    default_enabled = False
+
+    def Apply(self, doc):
+        max_suggestions = self.options.get("max_suggestions", 3)
+        min_score = self.options.get("min_score", 0.5)
+
+        for include in [doc.pch] + doc.includes:
+            cname = GetIncludeName(include)
+            if cname is None or IsWhitelisted(include):
+                continue
+            if cname in userHeaders or cname in engineHeaders or FindHeaderIgnoreCase(cname)[0] is not None:
+                continue
+
+            matches = userLookup.FindSimilar(cname, max_suggestions, min_score) + engineLookup.FindSimilar(cname, max_suggestions, min_score)
+            matches = sorted(matches, key=lambda match: -match[0])
+            if len(matches) == 0:
+                continue
+
+            suggestions = [GetIncludePath(FormatInclude(info)) for score, info in matches[:max_suggestions]]
+            doc.Report("Unresolved include. [{}.{}] {} Did you mean: {}".format(doc.info.cname, doc.extension, include, ", ".join(suggestions)))
+
+
+@RegisterRule
+class GeneratedHeaderRule(LintRule):
+    name = "generated_header"
+    scope = SCOPE_BODY
+    extensions = ["h"]
+
+    def Apply(self, doc):
+        if doc.genheader or not HasUObjectMacros(doc.rawLines):
+            return
+
+        # If we need a generated header but don't have one, create it
+        for line in doc.rawLines:
+            if ".generated.h" in line:
+                return
+
+        doc.genheader = f'#include "{doc.info.cname}.generated.h"'
+
+
+@RegisterRule
+class StrayIncludesRule(LintRule):
+    name = "stray_includes"
+    scope = SCOPE_BODY
+
+    def Apply(self, doc):
+        for line in doc.code:
+            if IsLineInclude(line):
+                doc.Report("WARN: Include not processed: %s.%s" % (doc.info.cname, doc.extension))
+
+
+@RegisterRule
+class BlueprintCategoryRule(LintRule):
+    name = "blueprint_category"
+    scope = SCOPE_BODY
+    extensions = ["h"]
+
+    def Apply(self, doc):
+        for message in ValidateHeaderRawLines(doc.rawLines, doc.info.cname):
+            doc.Report(message)
 
-    rawLines = readFile(filePath)
+
+@RegisterRule
+class BannedIncludesRule(LintRule):
+    name = "banned_includes"
+    default_enabled = False
+
+    def Apply(self, doc):
+        banned = self.options.get("includes", [])
+        for include in [doc.pch] + doc.includes + doc.custom_includes:
+            path = GetIncludePath(include)
+            if path is None:
+                continue
+            if path in banned or path.split("/")[-1] in banned:
+                doc.Report("Banned include. [{}.{}] {}".format(doc.info.cname, doc.extension, include))
+
+
+@RegisterRule
+class RequiredApiMacroRule(LintRule):
+    name = "required_api_macro"
+    scope = SCOPE_BODY
+    extensions = ["h"]
+    default_enabled = False
+
+    def Apply(self, doc):
+        # Only public headers are visible to other modules
+        if pathlib.Path(doc.info.rootdir).name != "Public":
+            return
+
+        module_name = pathlib.Path(doc.info.rootdir).parent.name
+        macro = self.options.get("macro", module_name.upper() + "_API")
+        macros = self.options.get("types", ["UCLASS"])
+        pattern_macro = r'(%s)\s*\(' % "|".join(macros)
+        pattern_decl = r'^\s*(class|struct)\s+(\w+)'
+
+        bExpectDeclaration = False
+        for i, rawLine in enumerate(doc.rawLines):
+            line = StripComment(rawLine)
+            if re.search(pattern_macro, line):
+                bExpectDeclaration = True
+                continue
+
+            m = re.search(pattern_decl, line)
+            if bExpectDeclaration and m:
+                bExpectDeclaration = False
+                if m.group(2) != macro:
+                    doc.Report("Missing {} on exported type. [{}.h:{}] {}".format(macro, doc.info.cname, i + 1, line))
+
+
+@RegisterRule
+class LongFilenamesRule(LintRule):
+    name = "long_filenames"
+    scope = SCOPE_PLUGIN
+    extensions = []
+
+    def CheckPlugin(self, PluginPath):
+        max_filename_length = self.options.get("max_length", 170)
+        long_filenames = check_filenames(PluginPath, max_filename_length)
+
+        if long_filenames:
+            PrintError(f"The following files in the '{PluginPath.name}' plugin have filenames greater than {max_filename_length} characters:")
+            for filename in long_filenames:
+                PrintError(filename)
+
+
+def CreateRules(RulesConfig):
+    for name in RulesConfig:
+        if not name in LINT_RULES:
+            PrintError("Unknown lint rule: %s" % name)
+
+    rules = []
+    for name, RuleClass in LINT_RULES.items():
+        options = RulesConfig.get(name, RuleClass.default_enabled)
+        if isinstance(options, bool):
+            if not options:
+                continue
+            options = {}
+        elif not isinstance(options, dict):
+            PrintError("Invalid options for lint rule %s, expected true, false or an object: %s" % (name, json.dumps(options)))
+            continue
+        elif not options.get("enabled", True):
+            continue
+        rules.append(RuleClass(options))
+    return rules
+
+
+ACTIVE_RULES = CreateRules({})
+
+
+def RulesNeedBody(extension):
+    for rule in ACTIVE_RULES:
+        if rule.scope == SCOPE_BODY and extension in rule.extensions:
+            return True
+    return False
+
+
+def ApplyRules(doc):
+    for rule in ACTIVE_RULES:
+        if not doc.extension in rule.extensions:
+            continue
+        if rule.scope == SCOPE_BODY and not doc.complete:
+            continue
+
+        start = time.thread_time()
+        rule.Apply(doc)
+        rule.cpu_time += time.thread_time() - start
+
+
+def CheckPluginRules(PluginPath):
+    for rule in ACTIVE_RULES:
+        start = time.thread_time()
+        rule.CheckPlugin(PluginPath)
+        rule.cpu_time += time.thread_time() - start
+
+
+def PrintRuleTimings(report_format):
+    if report_format == "json":
+        print(json.dumps({"rule_cpu_time": {rule.name: rule.cpu_time for rule in ACTIVE_RULES}}), flush=True)
+        return
+
+    print("Rule CPU time:")
+    for rule in ACTIVE_RULES:
+        print("  %-20s %8.3f ms" % (rule.name, rule.cpu_time * 1000))
+
+
+########################################################################
+
+def readPreamble(path, extension):
+    # Reads up to and including the first line of code. Returns the lines and whether the
+    # end of the file was reached
+    lines = []
+    bCustomHeaderBlock = False
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            for rawLine in line.splitlines():
+                lines.append(rawLine)
+                if IsCustomHeaderBlockComment(rawLine):
+                    bCustomHeaderBlock = not bCustomHeaderBlock
+                elif not bCustomHeaderBlock and not IsPreambleLine(rawLine, extension):
+                    return lines, False
+    return lines, True
+
+
+def LoadDocument(info, extension, preambleOnly=False):
+    filePath = GetFilePath(info, extension)
+    if preambleOnly:
+        rawLines, complete = readPreamble(filePath, extension)
+    else:
+        rawLines, complete = readFile(filePath), True
+    return LintDocument(info, extension, rawLines, complete)
+
+
+# returns the rewritten lines of a source file, or None if it should be left alone
+def BuildSourceLines(doc):
+    rawLines = doc.rawLines
     if len(rawLines) > 0 and ShouldIgnoreFile(rawLines[0]):
-        return False
+        return None
 
-    ValidateHeaderRawLines(rawLines, info.cname)
-    success, base_includes, custom_includes, genheader, code = ProcessHeaderRawLines(rawLines, info.cname)
+    if doc.complete:
+        EnsureLineEnding(rawLines)
 
+    success, doc.copyright, doc.pch, doc.includes, doc.custom_includes, doc.code = ProcessSourceRawLines(rawLines)
     if not success:
-        return False
+        doc.Report("WARN: Malformed custom include block. %s.%s" % (doc.info.cname, doc.extension))
+        return None
+
+    ApplyRules(doc)
 
-    includes = ProcessIncludes(base_includes)
+    includes = []
+    includes.append(doc.pch)
+    includes.append("")
+    includes.extend(doc.includes)
+    includes.extend(doc.custom_includes)
 
     lines = []
-    lines.append(COPYRIGHT_NOTICE)
+    if doc.copyright is not None:
+        lines.append(doc.copyright)
+        lines.append("")
+    lines.extend(includes)
     lines.append("")
+    lines.extend(doc.code)
+    return lines
+
+
+# returns the rewritten lines of a header file, or None if it should be left alone
+def BuildHeaderLines(doc):
+    rawLines = doc.rawLines
+    if len(rawLines) > 0 and ShouldIgnoreFile(rawLines[0]):
+        return None
+
+    if doc.complete:
+        EnsureLineEnding(rawLines)
+
+    success, doc.copyright, doc.includes, doc.custom_includes, doc.genheader, doc.code = ProcessHeaderRawLines(rawLines)
+    if not success:
+        doc.Report("WARN: Malformed custom include block. %s.%s" % (doc.info.cname, doc.extension))
+        return None
+
+    ApplyRules(doc)
+
+    lines = []
+    if doc.copyright is not None:
+        lines.append(doc.copyright)
+        lines.append("")
     lines.append("#pragma once")
     lines.append("#include \"CoreMinimal.h\"")
-    lines.extend(includes)
-    lines.extend(custom_includes)
-    if genheader:
-        lines.append(genheader)
+    lines.extend(doc.includes)
+    lines.extend(doc.custom_includes)
+    if doc.genheader:
+        lines.append(doc.genheader)
 
     lines.append("")
-    lines.extend(code)
+    lines.extend(doc.code)
+    return lines
+
 
-    if AreLinesEqual(rawLines, lines):
+def BuildFileLines(doc):
+    if doc.extension == "cpp":
+        return BuildSourceLines(doc)
+    return BuildHeaderLines(doc)
+
+
+def PrintDiagnostics(diagnostics):
+    for message in diagnostics:
+        print(message)
+
+
+def ProcessFile(info, extension):
+    doc = LoadDocument(info, extension)
+    lines = BuildFileLines(doc)
+    PrintDiagnostics(doc.diagnostics)
+    if lines is None or AreLinesEqual(doc.rawLines, lines):
         return False
 
-    writeFile(filePath, lines)
+    writeFile(GetFilePath(info, extension), lines)
     return True
 
 
+def ProcessSourceFile(info):
+    # print("Source:", info.cname)
+    return ProcessFile(info, "cpp")
+
+
+def ProcessHeaderFile(info):
+    # print("Header:", info.cname)
+    return ProcessFile(info, "h")
+
+
 def RTrimFromSubStr(text, substr):
     index = text.rfind(substr)
     if index != -1:
@@ -556,7 +967,7 @@ def score_path(path, preferred_paths):
     return 0
 
 
-def GenerateFileList(rootdir, extension, fileList, engineFiles=False, preferred_paths=[]):
+def IterFileList(rootdir, extension, engineFiles=False):
     for dir, subdirs, files in os.walk(rootdir):
         reldir = dir[len(rootdir) + 1:]
         reldir = reldir.replace("\\", "/")
@@ -593,85 +1004,499 @@ def GenerateFileList(rootdir, extension, fileList, engineFiles=False, preferred_
                     continue
 
             cname = file[:-len(extension) - 1]
-            fileInfo = FileInfo(rootdir, reldir, cname, module_path)
-            new_score = score_path(module_path, preferred_paths)
+            yield FileInfo(rootdir, reldir, cname, module_path)
 
-            if cname in fileList:
-                existing_score = score_path(fileList[cname].module_path, preferred_paths)
-                if new_score > existing_score:
-                    fileList[cname] = fileInfo
-            else:
+
+def GenerateFileList(rootdir, extension, fileList, engineFiles=False, preferred_paths=[]):
+    for fileInfo in IterFileList(rootdir, extension, engineFiles):
+        cname = fileInfo.cname
+        new_score = score_path(fileInfo.module_path, preferred_paths)
+
+        if cname in fileList:
+            existing_score = score_path(fileList[cname].module_path, preferred_paths)
+            if new_score > existing_score:
                 fileList[cname] = fileInfo
+        else:
+            fileList[cname] = fileInfo
+
+
+        #if True:  # not cname in fileList:
+        #    if file.endswith(".%s" % extension):
+        #        fileList[cname] = fileInfo
+
+
+########################################################################
+# Engine index
+#
+# The engine headers of a version are indexed from its Runtime and Editor source folders.
+# Indexes are cached per engine version under cache/, keyed on the engine path and the
+# preferred paths. An index also records the modification time of every folder it was
+# built from. Adding, removing or moving a header changes the time of its folder, so a
+# cached index is rebuilt as soon as one of them differs. Pass --rebuild-index to force a
+# rebuild anyway
+#
+# A cached index is memory mapped read-only and queried in place, so every lint process on
+# a machine shares one page-cached copy and nothing is deserialized on load. Layout:
+#
+#   header   magic (8 bytes), entry count (u32), string pool offset (u32),
+#            folder count (u32), folder table offset (u32)
+#   entries  one per header, sorted by name: (offset, length) pairs into the string pool
+#            for the cname, rootdir, dir and module_path fields, as 8 x u32
+#   lower    one per header, sorted by lowercase name: the index of its entry as u32. Lets
+#            includes with the wrong case be resolved without reading every name
+#   folders  one per source folder: (offset, length) of its path in the string pool as
+#            2 x u32, and its modification time in nanoseconds as i64
+#   pool     UTF-8 strings, each stored once
+
+ENGINE_INDEX_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cache")
+
+
+def GetEngineDirs(EngineSource):
+    return [
+        "%s/Runtime" % EngineSource,
+        "%s/Editor" % EngineSource]
+
+
+def GetFolderTime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+# returns {folder: modification time} for every folder an engine index is built from
+def GetEngineFolderTimes(EngineSource):
+    folders = {}
+    for enginedir in GetEngineDirs(EngineSource):
+        folders[enginedir] = GetFolderTime(enginedir)
+        for dir, subdirs, files in os.walk(enginedir):
+            for subdir in subdirs:
+                path = os.path.join(dir, subdir)
+                folders[path] = GetFolderTime(path)
+    return folders
+
+
+def BuildEngineIndex(EngineSource, preferred_paths):
+    headers = {}
+    for enginedir in GetEngineDirs(EngineSource):
+        GenerateFileList(enginedir, "h", headers, True, preferred_paths)
+    return headers
+
+
+def BuildExternalIndex(SolutionDir, PluginConfig):
+    # Headers of the game modules and other plugins this plugin depends on
+    externalHeaders = {}
+    if "external_game_modules" in PluginConfig:
+        for GameModuleName in PluginConfig["external_game_modules"]:
+            ExternalGameModPath = SolutionDir / "Source" / GameModuleName
+            if ExternalGameModPath.exists():
+                GenerateFileList(str(ExternalGameModPath), "h", externalHeaders, True)
+            else:
+                PrintInfo("ERROR: Cannot find game module path: " + GameModuleName)
+
+    if "external_plugins" in PluginConfig:
+        for ExternalPluginName in PluginConfig["external_plugins"]:
+            ExternalPluginPath = SolutionDir / "Plugins" / "GameFeatures" / ExternalPluginName
+            if not ExternalPluginPath.exists():
+                ExternalPluginPath = SolutionDir / "Plugins" / ExternalPluginName
+
+            if ExternalPluginPath.exists():
+                GenerateFileList(str(ExternalPluginPath), "h", externalHeaders, True)
+            else:
+                PrintInfo("ERROR: Cannot find plugin path: " + ExternalPluginName)
+
+    return externalHeaders
+
+
+def GetEngineIndexCachePath(EngineVersion, EngineSource, preferred_paths):
+    key = [EngineSource, preferred_paths]
+    digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(ENGINE_INDEX_CACHE_DIR, "engine_%s_%s.idx" % (EngineVersion, digest))
+
+
+ENGINE_INDEX_MAGIC = b"UEHIDX03"
+ENGINE_INDEX_HEADER = struct.Struct("<8sIIII")
+ENGINE_INDEX_ENTRY = struct.Struct("<8I")
+ENGINE_INDEX_LOWER = struct.Struct("<I")
+ENGINE_INDEX_FOLDER = struct.Struct("<IIq")
+
+
+class MappedHeaderIndex(Mapping):
+    # Read-only cname -> FileInfo map over a memory mapped index file
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self.pool, self.folder_count, self.folders = ENGINE_INDEX_HEADER.unpack_from(self.data, 0)
+        if magic != ENGINE_INDEX_MAGIC:
+            self.data.close()
+            raise ValueError("Not a header index: %s" % path)
+        self.lower = ENGINE_INDEX_HEADER.size + self.count * ENGINE_INDEX_ENTRY.size
+
+    def Close(self):
+        self.data.close()
+
+    # returns whether none of the folders the index was built from changed since
+    def IsCurrent(self):
+        for index in range(self.folder_count):
+            offset, length, mtime = ENGINE_INDEX_FOLDER.unpack_from(self.data, self.folders + index * ENGINE_INDEX_FOLDER.size)
+            if GetFolderTime(self._String(offset, length).decode("utf-8")) != mtime:
+                return False
+        return True
+
+    def _Entry(self, index):
+        return ENGINE_INDEX_ENTRY.unpack_from(self.data, ENGINE_INDEX_HEADER.size + index * ENGINE_INDEX_ENTRY.size)
+
+    def _String(self, offset, length):
+        return self.data[self.pool + offset:self.pool + offset + length]
+
+    def _Find(self, cname):
+        key = cname.encode("utf-8")
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._Entry(mid)
+            name = self._String(entry[0], entry[1])
+            if name < key:
+                lo = mid + 1
+            elif name > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def _LowerEntry(self, index):
+        entry_index, = ENGINE_INDEX_LOWER.unpack_from(self.data, self.lower + index * ENGINE_INDEX_LOWER.size)
+        return self._Entry(entry_index)
+
+    # returns the FileInfo of the first header whose name matches ignoring case, or None
+    def FindIgnoreCase(self, cname):
+        key = cname.lower()
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._LowerEntry(mid)
+            if self._String(entry[0], entry[1]).decode("utf-8").lower() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == self.count:
+            return None
+        entry = self._LowerEntry(lo)
+        if self._String(entry[0], entry[1]).decode("utf-8").lower() != key:
+            return None
+        return self._Decode(entry)
+
+    def _Decode(self, entry):
+        name, rootdir, dir, module_path = [self._String(entry[i], entry[i + 1]).decode("utf-8") for i in range(0, 8, 2)]
+        return FileInfo(rootdir, dir, name, module_path)
+
+    def __getitem__(self, cname):
+        entry = self._Find(cname)
+        if entry is None:
+            raise KeyError(cname)
+        return self._Decode(entry)
+
+    def __contains__(self, cname):
+        return self._Find(cname) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            entry = self._Entry(index)
+            yield self._String(entry[0], entry[1]).decode("utf-8")
+
+
+def WriteEngineIndexCache(cache_path, headers, folders):
+    pool = bytearray()
+    offsets = {}
+
+    def AddString(text):
+        data = text.encode("utf-8")
+        if not data in offsets:
+            offsets[data] = len(pool)
+            pool.extend(data)
+        return offsets[data], len(data)
+
+    entries = []
+    infos = sorted(headers.values(), key=lambda info: info.cname.encode("utf-8"))
+    for info in infos:
+        fields = []
+        for text in [info.cname, info.rootdir, info.dir, info.module_path]:
+            fields.extend(AddString(text))
+        entries.append(ENGINE_INDEX_ENTRY.pack(*fields))
+
+    # Ties keep the name order, so the first of several names that differ only in case wins
+    order = sorted(range(len(infos)), key=lambda index: infos[index].cname.lower())
+    lower_entries = [ENGINE_INDEX_LOWER.pack(index) for index in order]
+
+    folder_entries = []
+    for path, mtime in sorted(folders.items()):
+        folder_entries.append(ENGINE_INDEX_FOLDER.pack(*AddString(path), mtime))
+
+    folder_offset = ENGINE_INDEX_HEADER.size + len(entries) * (ENGINE_INDEX_ENTRY.size + ENGINE_INDEX_LOWER.size)
+    pool_offset = folder_offset + len(folder_entries) * ENGINE_INDEX_FOLDER.size
+
+    # Write to a temporary file and swap it in, so a concurrent reader never sees a partial index
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ENGINE_INDEX_HEADER.pack(ENGINE_INDEX_MAGIC, len(entries), pool_offset, len(folder_entries), folder_offset))
+            f.write(b"".join(entries))
+            f.write(b"".join(lower_entries))
+            f.write(b"".join(folder_entries))
+            f.write(pool)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only. The cache is shared by every user
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # Another process published the same index first and it is mapped (Windows won't
+        # replace a mapped file). Its copy is just as good, as long as it is up to date
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if not IsEngineIndexCurrent(cache_path):
+            raise
+
+
+def IsEngineIndexCurrent(cache_path):
+    try:
+        index = MappedHeaderIndex(cache_path)
+    except (OSError, ValueError):
+        # Missing, or written by an older version of the script
+        return False
+
+    current = index.IsCurrent()
+    index.Close()
+    return current
+
+
+# Builds the cached index of an engine version if it is missing or out of date. returns its path
+def EnsureEngineIndex(EngineVersion, EngineSource, preferred_paths, rebuild=False):
+    cache_path = GetEngineIndexCachePath(EngineVersion, EngineSource, preferred_paths)
+    if rebuild or not IsEngineIndexCurrent(cache_path):
+        # Folder times are taken first, so a change made while indexing is caught next time
+        folders = GetEngineFolderTimes(EngineSource)
+        WriteEngineIndexCache(cache_path, BuildEngineIndex(EngineSource, preferred_paths), folders)
+    return cache_path
+
+
+def LoadEngineIndex(EngineVersion, EngineSource, preferred_paths, rebuild=False):
+    return MappedHeaderIndex(EnsureEngineIndex(EngineVersion, EngineSource, preferred_paths, rebuild))
+
+
+########################################################################
+# Lint pipeline
+#
+# Files flow through a chain of generators: discover -> read -> analyze -> rewrite -> report.
+# Each stage pulls from the one before it, so only the files inside the read-ahead window
+# are held in memory at any time, no matter how large the plugin is
+
+DEFAULT_PIPELINE_WINDOW = 16
+MAX_READ_THREADS = 8
+
+FileResult = namedtuple("FileResult", "extension info modified diagnostics")
+
+
+def DiscoverFiles(rootdirs):
+    # Sources are streamed straight off the disk. Headers come from userHeaders, which has
+    # to be complete up front since every file needs it to classify its includes
+    discovered = set()
+    for rootdir in rootdirs:
+        for subdir in ["Public", "Private"]:
+            for info in IterFileList("%s/%s" % (rootdir, subdir), "cpp"):
+                if info.cname in discovered:
+                    continue
+                discovered.add(info.cname)
+                yield "cpp", info
+
+    for info in userHeaders.values():
+        yield "h", info
 
 
-            #if True:  # not cname in fileList:
-            #    if file.endswith(".%s" % extension):
-            #        fileList[cname] = fileInfo
+def ReadFiles(items, window):
+    # Reads run ahead of the consumer on a thread pool, but by no more than `window` files.
+    # Files are read in full only if an enabled rule needs more than the include preamble
+    window = max(1, window)
+    preambleOnly = {"h": not RulesNeedBody("h"), "cpp": not RulesNeedBody("cpp")}
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=min(window, MAX_READ_THREADS)) as executor:
+        for extension, info in items:
+            pending.append(executor.submit(LoadDocument, info, extension, preambleOnly[extension]))
+            if len(pending) >= window:
+                yield pending.popleft().result()
 
+        while pending:
+            yield pending.popleft().result()
 
-# Parse the engine code
-# print("Paring engine code")
-for enginedir in enginedirs:
-    GenerateFileList(enginedir, "h", engineHeaders, True, preferred_paths)
 
-print("Parsed engine code [%d Headers]" % len(engineHeaders))
+def AnalyzeFiles(docs):
+    for doc in docs:
+        lines = BuildFileLines(doc)
+        if lines is not None and not doc.complete and not AreLinesEqual(doc.rawLines, lines):
+            # The preamble changed, so the rest of the file is needed to rewrite it
+            doc = LoadDocument(doc.info, doc.extension)
+            lines = BuildFileLines(doc)
+        yield doc, lines
 
-externalHeaders = {}
-if "external_game_modules" in PluginConfig:
-    for GameModuleName in PluginConfig["external_game_modules"]:
-        ExternalGameModPath = SolutionDir / "Source" / GameModuleName
-        if ExternalGameModPath.exists():
-            GenerateFileList(str(ExternalGameModPath), "h", externalHeaders, True)
+
+def RewriteFiles(items):
+    for doc, lines in items:
+        modified = lines is not None and not AreLinesEqual(doc.rawLines, lines)
+        if modified:
+            writeFile(GetFilePath(doc.info, doc.extension), lines)
+        yield FileResult(doc.extension, doc.info, modified, doc.diagnostics)
+
+
+def GetDisplayPath(info, extension):
+    if len(info.dir) == 0:
+        return "%s.%s" % (info.cname, extension)
+    return "%s/%s.%s" % (info.dir, info.cname, extension)
+
+
+# returns the number of headers and sources modified
+def ReportResults(results, report_format):
+    NumSourceFilesModified = 0
+    NumHeaderFilesModified = 0
+
+    for result in results:
+        path = GetDisplayPath(result.info, result.extension)
+        if report_format == "json":
+            print(json.dumps({"file": path, "module": pathlib.Path(result.info.rootdir).parent.name, "modified": result.modified, "diagnostics": result.diagnostics}), flush=True)
         else:
-            print("ERROR: Cannot find game module path: " + GameModuleName)
+            PrintDiagnostics(result.diagnostics)
+            if result.modified:
+                print("Written: " + path, flush=True)
 
-if "external_plugins" in PluginConfig:
-    for ExternalPluginName in PluginConfig["external_plugins"]:
-        ExternalPluginPath = SolutionDir / "Plugins" / "GameFeatures" / ExternalPluginName
-        if not ExternalPluginPath.exists():
-            ExternalPluginPath = SolutionDir / "Plugins" / ExternalPluginName
+        if not result.modified:
+            continue
 
-        if ExternalPluginPath.exists():
-            GenerateFileList(str(ExternalPluginPath), "h", externalHeaders, True)
+        if result.extension == "cpp":
+            NumSourceFilesModified = NumSourceFilesModified + 1
         else:
-            print("ERROR: Cannot find plugin path: " + ExternalPluginName)
+            NumHeaderFilesModified = NumHeaderFilesModified + 1
+
+    return NumHeaderFilesModified, NumSourceFilesModified
+
+
+def RunPipeline(rootdirs, window=DEFAULT_PIPELINE_WINDOW, report_format="console"):
+    files = DiscoverFiles(rootdirs)
+    files = ReadFiles(files, window)
+    files = AnalyzeFiles(files)
+    results = RewriteFiles(files)
+    return ReportResults(results, report_format)
+
+
+def main(argv):
+    global COPYRIGHT_NOTICE, WHITELIST_PATHS, IGNORE_FILES, REPORT_FORMAT, ACTIVE_RULES, engineHeaders
+
+    bRebuildIndex = "--rebuild-index" in argv
+    argv = [arg for arg in argv if arg != "--rebuild-index"]
+
+    if len(argv) < 3:
+        PrintUsage()
+        sys.exit()
+
+    debug_logger = DebugLogger()
+    SolutionDir = pathlib.Path(argv[1])
+
+    UPROJECT_FILE = FindUProjectFile(SolutionDir)
+    if not UPROJECT_FILE:
+        print("Cannot find uproject file")
+        sys.exit();
+
+    UProjectJson = ReadJson(UPROJECT_FILE)
+    ENGINE_VERSION = UProjectJson["EngineAssociation"]
+
+    CurrentFileDir = pathlib.Path(argv[2])
+
+    PluginPath = FindPluginPath(CurrentFileDir)
+
+    if not PluginPath.parent:
+        PrintError("Cannot find plugin path")
+        sys.exit();
+
+    # grab the script config
+    BaseConfig = GetBaseConfig()
+    if not BaseConfig:
+        PrintError("cannot find base config file. aborting..")
+        sys.exit()
+
+    preferred_paths = BaseConfig.get("preferred_paths", [])
+
+    # grab the plugin config
+    PluginConfig = GetPluginConfig(PluginPath)
+    ScriptEnabled = PluginConfig.get("enabled", False)
+
+    if not ScriptEnabled:
+        PrintError("Header lint is not enabled in this module")
+        sys.exit()
+
+    if not ENGINE_VERSION in BaseConfig["engine_path"]:
+        PrintError("Unsupported engine version: %s" % ENGINE_VERSION)
+        sys.exit()
+
+    # Configuration
+    ENGINE_SOURCE = BaseConfig["engine_path"][ENGINE_VERSION]
+    COPYRIGHT_NOTICE = BaseConfig["copyright"]
+    WHITELIST_PATHS = PluginConfig.get("whitelist_includes", [])
+    IGNORE_FILES = PluginConfig.get("ignore_files", [])
+    PIPELINE_WINDOW = PluginConfig.get("pipeline_window", DEFAULT_PIPELINE_WINDOW)
+    REPORT_FORMAT = PluginConfig.get("report_format", "console")
+    ACTIVE_RULES = CreateRules(PluginConfig.get("rules", {}))
+    ###
+
+    PrintInfo("Engine: " + ENGINE_VERSION)
+    PrintInfo("Plugin: " + PluginPath.name)
+
+    if not COPYRIGHT_NOTICE:
+        PrintError("copyright not provided in base configuration")
+        sys.exit()
+
+    ModuleList = GetPluginModules(PluginPath, PluginConfig)
+    PrintInfo("Modules: " + ", ".join([x.name for x in ModuleList]))
+
+    rootdirs = ModuleList
 
-print("Parsed external code [%d Headers]" % len(externalHeaders))
+    # Load the engine index, building it on first use
+    engineIndex = LoadEngineIndex(ENGINE_VERSION, ENGINE_SOURCE, preferred_paths, bRebuildIndex)
 
-engineHeaders.update(externalHeaders)
+    PrintInfo("Parsed engine code [%d Headers]" % len(engineIndex))
 
-# Parse the plugin code
-sourceList = {}
-for rootdir in rootdirs:
-    rootPublic = "%s/Public" % rootdir
-    rootPrivate = "%s/Private" % rootdir
-    GenerateFileList(rootPublic, "h", userHeaders)
-    GenerateFileList(rootPrivate, "h", userHeaders)
-    GenerateFileList(rootPublic, "cpp", sourceList)
-    GenerateFileList(rootPrivate, "cpp", sourceList)
-print("Parsed local code [%d Headers, %d Sources]" % (len(userHeaders), len(sourceList)))
+    externalHeaders = BuildExternalIndex(SolutionDir, PluginConfig)
+    PrintInfo("Parsed external code [%d Headers]" % len(externalHeaders))
 
-NumSourceFilesModified = 0
-NumHeaderFilesModified = 0
+    # External headers take precedence over engine headers with the same name
+    engineHeaders = ChainMap(externalHeaders, engineIndex)
 
-for key, info in sourceList.items():
-    if ProcessSourceFile(info):
-        NumSourceFilesModified = NumSourceFilesModified + 1
+    # Parse the plugin headers. Sources are discovered lazily by the pipeline
+    for rootdir in rootdirs:
+        GenerateFileList("%s/Public" % rootdir, "h", userHeaders)
+        GenerateFileList("%s/Private" % rootdir, "h", userHeaders)
+    PrintInfo("Parsed local code [%d Headers]" % len(userHeaders))
+    BuildHeaderLookups()
 
-for key, info in userHeaders.items():
-    if ProcessHeaderFile(info):
-        NumHeaderFilesModified = NumHeaderFilesModified + 1
+    NumHeaderFilesModified, NumSourceFilesModified = RunPipeline(rootdirs, PIPELINE_WINDOW, REPORT_FORMAT)
 
-message = "Written " + bcolors.BOLD + bcolors.OKCYAN + "%d" + bcolors.ENDC + " Headers, " + bcolors.BOLD + bcolors.OKCYAN + "%d" + bcolors.ENDC + " Sources"
-print(message % (NumHeaderFilesModified, NumSourceFilesModified))
+    if REPORT_FORMAT == "json":
+        print(json.dumps({"summary": {"headers_written": NumHeaderFilesModified, "sources_written": NumSourceFilesModified}}), flush=True)
+    else:
+        message = "Written " + bcolors.BOLD + bcolors.OKCYAN + "%d" + bcolors.ENDC + " Headers, " + bcolors.BOLD + bcolors.OKCYAN + "%d" + bcolors.ENDC + " Sources"
+        print(message % (NumHeaderFilesModified, NumSourceFilesModified))
 
 
-# Check for long filenames
-max_filename_length = 170
-long_filenames = check_filenames(PluginPath, max_filename_length)
+    CheckPluginRules(PluginPath)
+    PrintRuleTimings(REPORT_FORMAT)
 
-if long_filenames:
-    PrintError(f"The following files in the '{PluginPath.name}' plugin have filenames greater than {max_filename_length} characters:")
-    for filename in long_filenames:
-        PrintError(filename)
 
+if __name__ == "__main__":
+    main(sys.argv)
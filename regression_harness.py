@@ -0,0 +1,526 @@
+import io
+import os
+import sys
+import time
+import random
+import shutil
+import difflib
+import pathlib
+import tempfile
+import contextlib
+from collections import ChainMap
+
+import fix_header
+from fix_header import (CreateRules, BuildEngineIndex, BuildExternalIndex, GetEngineFolderTimes, WriteEngineIndexCache,
+                        MappedHeaderIndex, GenerateFileList, BuildHeaderLookups, ProcessSourceFile, ProcessHeaderFile,
+                        RunPipeline)
+
+# Differential test of the lint. The reference is the plain serial path (ProcessSourceFile and
+# ProcessHeaderFile over a freshly walked engine index), pinned to the output of the original
+# script on the hand written fixtures. Every optimized mode runs over its own copy of the same
+# fixture trees and must leave the files byte-for-byte identical.
+
+COPYRIGHT = "//$ Copyright Regression Harness $//"
+PREFERRED_PATHS = ["Engine/Public/GameFramework", "Engine/Classes/Components", "UnrealEd/Public/Factories"]
+WHITELIST = ["Foo/Bar.h"]
+IGNORE = ["Skipped.cpp"]
+
+# Rules that need more than the include preamble are switched off to let the scanner read
+# preamble-only. The reference runs with the same rules, so only the I/O path differs
+PREAMBLE_RULES = {"generated_header": False, "stray_includes": False, "blueprint_category": False}
+
+ENGINE_FILES = [
+    "Runtime/Core/Public/CoreMinimal.h",
+    "Runtime/Core/Public/Misc/Paths.h",
+    "Runtime/Core/Public/Containers/Array.h",
+    "Runtime/Core/Public/Math/Vector.h",
+    "Runtime/CoreUObject/Public/UObject/Object.h",
+    # Duplicate cnames, resolved by the preferred paths. The walk is top-down, so the copy in
+    # the parent folder is always found first and only the preferred paths pick the other one
+    "Runtime/Engine/Public/Actor.h",
+    "Runtime/Engine/Public/GameFramework/Actor.h",
+    "Runtime/Engine/Classes/SceneComponent.h",
+    "Runtime/Engine/Classes/Components/SceneComponent.h",
+    "Runtime/Engine/Public/Engine/World.h",
+    "Editor/UnrealEd/Public/Factory.h",
+    "Editor/UnrealEd/Public/Factories/Factory.h",
+    "Editor/UnrealEd/Public/Editor.h",
+]
+
+# A plugin the linted one depends on. Its World.h shadows the engine's
+EXTERNAL_PLUGINS = ["ExtPlugin"]
+EXTERNAL_FILES = {
+    "Plugins/ExtPlugin/Source/ExtMod/Public/Custom/World.h": "#pragma once\n",
+    "Plugins/ExtPlugin/Source/ExtMod/Private/ExtHelper.h": "#pragma once\n",
+}
+
+BOM = "\ufeff"
+
+FIXTURE_FILES = {
+    "HarnessMod/Public/Core/HarnessActor.h": (
+        "#pragma once\n"
+        "#include \"CoreMinimal.h\"\n"
+        "#include \"Actor.h\"\n"
+        "#include \"HarnessTypes.h\"\n"
+        "#include \"HarnessActor.generated.h\"\n"
+        "\n"
+        "UCLASS()\n"
+        "class AHarnessActor : public AActor {\n"
+        "\tUPROPERTY(BlueprintReadWrite)\n"
+        "\tint Value;\n"
+        "};\n"),
+    "HarnessMod/Public/HarnessTypes.h": (
+        "//$ Copyright Old Notice $//\n"
+        "#include \"Paths.h\"\n"
+        "#include \"array.h\"\n"
+        "USTRUCT()\n"
+        "struct FHarnessTypes {};"),
+    "HarnessMod/Public/Bom.h": BOM + (
+        "#pragma once\r\n"
+        "#include \"Vector.h\"\r\n"
+        "#include \"Object.h\"\r\n"
+        "\r\n"
+        "UENUM()\r\n"
+        "enum class EBom { A };\r\n"),
+    "HarnessMod/Public/IncludesOnly.h": (
+        "#include \"World.h\"\n"
+        "#include \"SceneComponent.h\"\n"),
+    "HarnessMod/Public/Malformed.h": (
+        "#pragma once\n"
+        "//!!\n"
+        "#include \"Editor.h\"\n"
+        "class FMalformed {};\n"),
+    "HarnessMod/Private/Core/HarnessActor.cpp": (
+        "#include \"Core/HarnessActor.h\"\n"
+        "#include \"Paths.h\"\n"
+        "#include \"ExtHelper.h\"\n"
+        "#include \"HarnessTypes.h\"\n"
+        "//!!\n"
+        "#if WITH_EDITOR\n"
+        "#include \"Factory.h\"\n"
+        "#endif\n"
+        "//!!\n"
+        "\n"
+        "void Run() {}\n"),
+    "HarnessMod/Private/Ignored.cpp": (
+        "//~ Left alone by the lint\n"
+        "#include \"World.h\"\n"
+        "#include \"Actor.h\"\n"),
+    "HarnessMod/Private/Skipped.cpp": (
+        "#include \"World.h\"\n"
+        "#include \"Actor.h\"\n"),
+    "HarnessMod/Private/Bom.cpp": BOM + (
+        "#include \"Bom.h\"\r\n"
+        "#include \"Foo/Bar.h\"\r\n"
+        "#include \"SceneComponent.h\"\r\n"
+        "int BomValue;"),
+    "HarnessMod/Private/Whitelisted.cpp": (
+        COPYRIGHT + "\n"
+        "\n"
+        "#include \"IncludesOnly.h\"\n"
+        "\n"
+        "#include \"Foo/Bar.h\"\n"
+        "#include \"Misc/Paths.h\"\n"
+        "\n"
+        "int Value;\n"),
+    "HarnessMod/Private/BodyMarkers.cpp": (
+        "#include \"BodyMarkers.h\"\n"
+        "#include \"Actor.h\"\n"
+        "\n"
+        "void Body() {\n"
+        "//!!\n"
+        "}\n"
+        "#include \"Late.inl\"\n"
+        "#include \"Stray.h\"\n"),
+    "HarnessMod/Private/Empty.cpp": "",
+}
+
+# The fixture files after a lint with the default rules, as the original serial script left
+# them (external plugin included). The reference has to reproduce them, so a change to the
+# lint output itself is caught even though every mode shares the same rewriting code.
+# Deliberate differences are marked
+EXPECTED_FILES = {
+    # Differs from the original script, which took the //!! in the body for an unterminated
+    # custom include block and left the file alone. Markers only count in the preamble now
+    "HarnessMod/Private/BodyMarkers.cpp": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#include \"BodyMarkers.h\"\n"
+        "\n"
+        "#include \"GameFramework/Actor.h\"\n"
+        "\n"
+        "void Body() {\n"
+        "//!!\n"
+        "}\n"
+        "#include \"Late.inl\"\n"
+        "#include \"Stray.h\"\n"
+        "\n"),
+    "HarnessMod/Private/Bom.cpp": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#include \"Bom.h\"\n"
+        "\n"
+        "#include \"Components/SceneComponent.h\"\n"
+        "#include \"Foo/Bar.h\"\n"
+        "\n"
+        "int BomValue;\n"
+        "\n"),
+    "HarnessMod/Private/Core/HarnessActor.cpp": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#include \"Core/HarnessActor.h\"\n"
+        "\n"
+        "#include \"HarnessTypes.h\"\n"
+        "\n"
+        "#include \"ExtHelper.h\"\n"
+        "#include \"Misc/Paths.h\"\n"
+        "//!!\n"
+        "#if WITH_EDITOR\n"
+        "#include \"Factory.h\"\n"
+        "#endif\n"
+        "//!!\n"
+        "\n"
+        "void Run() {}\n"
+        "\n"),
+    "HarnessMod/Private/Empty.cpp": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "\n"
+        "\n"
+        "\n"),
+    "HarnessMod/Private/Ignored.cpp": (
+        "//~ Left alone by the lint\n"
+        "#include \"World.h\"\n"
+        "#include \"Actor.h\"\n"),
+    "HarnessMod/Private/Skipped.cpp": (
+        "#include \"World.h\"\n"
+        "#include \"Actor.h\"\n"),
+    "HarnessMod/Private/Whitelisted.cpp": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#include \"IncludesOnly.h\"\n"
+        "\n"
+        "#include \"Foo/Bar.h\"\n"
+        "#include \"Misc/Paths.h\"\n"
+        "\n"
+        "int Value;\n"),
+    "HarnessMod/Public/Bom.h": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#pragma once\n"
+        "#include \"CoreMinimal.h\"\n"
+        "#include \"Math/Vector.h\"\n"
+        "#include \"UObject/Object.h\"\n"
+        "#include \"Bom.generated.h\"\n"
+        "\n"
+        "UENUM()\n"
+        "enum class EBom { A };\n"
+        "\n"),
+    "HarnessMod/Public/Core/HarnessActor.h": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#pragma once\n"
+        "#include \"CoreMinimal.h\"\n"
+        "#include \"HarnessTypes.h\"\n"
+        "\n"
+        "#include \"GameFramework/Actor.h\"\n"
+        "#include \"HarnessActor.generated.h\"\n"
+        "\n"
+        "UCLASS()\n"
+        "class AHarnessActor : public AActor {\n"
+        "\tUPROPERTY(BlueprintReadWrite)\n"
+        "\tint Value;\n"
+        "};\n"
+        "\n"),
+    # Differs from the original script, which kept "array.h". Includes with the wrong case
+    # are repaired now
+    "HarnessMod/Public/HarnessTypes.h": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#pragma once\n"
+        "#include \"CoreMinimal.h\"\n"
+        "#include \"Containers/Array.h\"\n"
+        "#include \"Misc/Paths.h\"\n"
+        "#include \"HarnessTypes.generated.h\"\n"
+        "\n"
+        "USTRUCT()\n"
+        "struct FHarnessTypes {};\n"
+        "\n"),
+    "HarnessMod/Public/IncludesOnly.h": (
+        "//$ Copyright Regression Harness $//\n"
+        "\n"
+        "#pragma once\n"
+        "#include \"CoreMinimal.h\"\n"
+        "#include \"Components/SceneComponent.h\"\n"
+        "#include \"Custom/World.h\"\n"
+        "\n"),
+    "HarnessMod/Public/Malformed.h": (
+        "#pragma once\n"
+        "//!!\n"
+        "#include \"Editor.h\"\n"
+        "class FMalformed {};\n"),
+}
+
+
+def write_tree(root, files):
+    for path, content in files.items():
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+
+
+def generate_engine(count):
+    """Generate `count` engine headers spread over modules and folders like a real engine."""
+    files = {}
+    for index in range(count):
+        module = index // 400
+        root = "Editor" if module % 4 == 3 else "Runtime"
+        subdir = ["Public", "Classes", "Private", "Public/Sub%d" % (index % 7), "Private/Sub%d" % (index % 5)][index % 5]
+        files["%s/Syn%d/%s/Syn%05d.h" % (root, module, subdir, index)] = "#pragma once\n"
+    return files
+
+
+def generate_module(rng, count):
+    """Generate a module of `count` header/source pairs with messy, randomly ordered includes."""
+    names = ["Gen%03d" % i for i in range(count)]
+    engine_names = [os.path.basename(path)[:-2] for path in ENGINE_FILES if not "CoreMinimal" in path]
+    files = {}
+
+    def random_include(name):
+        if rng.random() < 0.1:
+            name = name.lower()
+        return "#include \"%s.h\"" % name
+
+    for index, name in enumerate(names):
+        includes = [random_include(rng.choice(names)) for _ in range(rng.randint(0, 4))]
+        includes += [random_include(rng.choice(engine_names)) for _ in range(rng.randint(0, 4))]
+        rng.shuffle(includes)
+
+        header = []
+        if rng.random() < 0.5:
+            header.append(COPYRIGHT)
+        if rng.random() < 0.7:
+            header.append("#pragma once")
+        header.extend(includes)
+        header.append("")
+        if rng.random() < 0.5:
+            header.append("UCLASS()")
+        header.append("class U%s {" % name)
+        if rng.random() < 0.3:
+            header.append("\tUFUNCTION(BlueprintCallable)")
+        header.append("\tvoid Tick();")
+        header.append("};")
+        files["GenMod/Public/Gen/%s.h" % name] = "\n".join(header) + ("\n" if index % 3 else "")
+
+        source = [random_include(name)] + [random_include(rng.choice(names)) for _ in range(rng.randint(0, 3))]
+        rng.shuffle(source)
+        source.append("")
+        source.append("void U%s::Tick() {}" % name)
+        files["GenMod/Private/Gen/%s.cpp" % name] = "\n".join(source) + "\n"
+
+    return files
+
+
+def snapshot(root):
+    result = {}
+    for dir, subdirs, files in os.walk(root):
+        for file in files:
+            path = os.path.join(dir, file)
+            with open(path, 'rb') as f:
+                result[os.path.relpath(path, root)] = f.read()
+    return result
+
+
+def run_serial(module_dirs):
+    # The lint as it ran before the pipeline: every source, then every header
+    sourceList = {}
+    for module_dir in module_dirs:
+        GenerateFileList("%s/Public" % module_dir, "cpp", sourceList)
+        GenerateFileList("%s/Private" % module_dir, "cpp", sourceList)
+
+    for info in sourceList.values():
+        ProcessSourceFile(info)
+    for info in list(fix_header.userHeaders.values()):
+        ProcessHeaderFile(info)
+
+
+def run_pipeline(window):
+    return lambda module_dirs: RunPipeline(module_dirs, window)
+
+
+def lint_pass(work, solution_dir, rules, engine_source, engine_index_path, runner):
+    module_dirs = [os.path.join(work, name).replace("\\", "/") for name in sorted(os.listdir(work))]
+
+    fix_header.COPYRIGHT_NOTICE = COPYRIGHT
+    fix_header.WHITELIST_PATHS = WHITELIST
+    fix_header.IGNORE_FILES = IGNORE
+    fix_header.ACTIVE_RULES = CreateRules(rules)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        externalHeaders = BuildExternalIndex(pathlib.Path(solution_dir), {"external_plugins": EXTERNAL_PLUGINS})
+        if engine_index_path:
+            fix_header.engineHeaders = ChainMap(externalHeaders, MappedHeaderIndex(engine_index_path))
+        else:
+            # Merged the way the lint did before the mapped index
+            fix_header.engineHeaders = BuildEngineIndex(engine_source, PREFERRED_PATHS)
+            fix_header.engineHeaders.update(externalHeaders)
+
+        fix_header.userHeaders.clear()
+        for module_dir in module_dirs:
+            GenerateFileList("%s/Public" % module_dir, "h", fix_header.userHeaders)
+            GenerateFileList("%s/Private" % module_dir, "h", fix_header.userHeaders)
+        BuildHeaderLookups()
+
+        runner(module_dirs)
+    return time.perf_counter() - start
+
+
+def run_mode(template, work, solution_dir, rules, engine_source, engine_index_path, runner):
+    """Lint a fresh copy of the fixture trees, then lint the result again.
+
+    returns [(files, time taken)] for the first pass (mostly rewrites) and the second pass
+    (an already clean tree, the usual case)
+    """
+    if os.path.exists(work):
+        shutil.rmtree(work)
+    shutil.copytree(template, work)
+
+    passes = []
+    for _ in range(2):
+        elapsed = lint_pass(work, solution_dir, rules, engine_source, engine_index_path, runner)
+        passes.append((snapshot(work), elapsed))
+    return passes
+
+
+def compare(expected, actual, expected_name="reference", actual_name="optimized"):
+    """returns a description of the first difference, or None if the trees are identical."""
+    for path in sorted(set(expected) | set(actual)):
+        if expected.get(path) == actual.get(path):
+            continue
+
+        if not path in actual or not path in expected:
+            return "%s exists in only one of the trees" % path
+
+        diff = difflib.unified_diff(expected[path].decode("utf-8", "replace").splitlines(),
+                                    actual[path].decode("utf-8", "replace").splitlines(),
+                                    expected_name + "/" + path, actual_name + "/" + path, lineterm="")
+        return "\n".join(diff)
+    return None
+
+
+def get_expected_difference(files, name):
+    """Compare the fixture files of a linted tree with EXPECTED_FILES. returns the first difference, or None."""
+    expected = {path: text.encode("utf-8") for path, text in EXPECTED_FILES.items()}
+    fixture_files = {path.replace(os.sep, "/"): data for path, data in files.items() if path.startswith("HarnessMod")}
+    return compare(expected, fixture_files, "expected", name)
+
+
+def check_expected(passes):
+    """Check both passes of the default rules reference against EXPECTED_FILES. returns True if they match."""
+    for (files, elapsed), label in zip(passes, ["first pass", "clean pass"]):
+        difference = get_expected_difference(files, "reference")
+        if difference:
+            print("FAIL: reference, %s" % label)
+            print(difference)
+            return False
+
+    print("OK:   reference matches the expected fixture output")
+    return True
+
+
+def check_preferred_paths(template, work, solution_dir, engine_source, root):
+    """Check that EXPECTED_FILES depends on the preferred paths, so a mode that loses them can't pass.
+
+    returns True if linting over an index built without them gives a different output
+    """
+    index_path = os.path.join(root, "cache", "engine_unpreferred.idx")
+    WriteEngineIndexCache(index_path, BuildEngineIndex(engine_source, []), GetEngineFolderTimes(engine_source))
+    passes = run_mode(template, work, solution_dir, {}, engine_source, index_path, run_serial)
+    if get_expected_difference(passes[0][0], "unpreferred") is None:
+        print("FAIL: the expected fixture output doesn't depend on the preferred paths")
+        return False
+
+    print("OK:   the expected fixture output depends on the preferred paths")
+    return True
+
+
+MODES = [
+    # name, rules, mapped engine index, runner
+    ("pipeline, window 1", {}, False, run_pipeline(1)),
+    ("pipeline, window 16", {}, False, run_pipeline(16)),
+    ("mapped engine index", {}, True, run_serial),
+    ("mapped engine index + pipeline", {}, True, run_pipeline(16)),
+    ("preamble-only reads", PREAMBLE_RULES, False, run_pipeline(16)),
+    ("preamble-only reads + mapped engine index", PREAMBLE_RULES, True, run_pipeline(16)),
+]
+
+
+def print_usage():
+    print("Usage: python regression_harness.py [<GeneratedFileCount> [<EngineHeaderCount>]]")
+
+
+def run_harness(generated_count=200, engine_count=30000, seed=1):
+    """Run every mode against the reference. returns True if all of them match."""
+    root = tempfile.mkdtemp(prefix="header_lint_harness_")
+    try:
+        engine_source = os.path.join(root, "Engine", "Source").replace("\\", "/")
+        write_tree(engine_source, {path: "// %s\n" % path for path in ENGINE_FILES})
+        # Padding, so the engine index costs what it does on a real engine
+        write_tree(engine_source, generate_engine(engine_count))
+
+        template = os.path.join(root, "Template")
+        write_tree(template, FIXTURE_FILES)
+        write_tree(template, generate_module(random.Random(seed), generated_count))
+
+        solution_dir = os.path.join(root, "Solution")
+        write_tree(solution_dir, EXTERNAL_FILES)
+
+        engine_index_path = os.path.join(root, "cache", "engine.idx")
+        WriteEngineIndexCache(engine_index_path, BuildEngineIndex(engine_source, PREFERRED_PATHS), GetEngineFolderTimes(engine_source))
+
+        work = os.path.join(root, "Work")
+        references = {}
+        success = check_preferred_paths(template, work, solution_dir, engine_source, root)
+        for name, rules, mapped, runner in MODES:
+            key = tuple(sorted(rules.items()))
+            if not key in references:
+                references[key] = run_mode(template, work, solution_dir, rules, engine_source, None, run_serial)
+                if references[key][0][0] == snapshot(template):
+                    print("FAIL: the reference run didn't rewrite anything")
+                    success = False
+                if not rules:
+                    success = check_expected(references[key]) and success
+
+            actual = run_mode(template, work, solution_dir, rules, engine_source, engine_index_path if mapped else None, runner)
+
+            matches = True
+            timings = []
+            for index, label in enumerate(["first pass", "clean pass"]):
+                expected, reference_time = references[key][index]
+                files, elapsed = actual[index]
+
+                difference = compare(expected, files)
+                if difference:
+                    matches = False
+                    print("FAIL: %s, %s" % (name, label))
+                    print(difference)
+                timings.append("%s %7.1f ms %5.2fx" % (label, elapsed * 1000, reference_time / elapsed))
+
+            print("%-5s %-42s %s" % ("OK:" if matches else "", name, "   ".join(timings)))
+            success = success and matches
+
+        return success
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        print_usage()
+        sys.exit(1)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    engine_count = int(sys.argv[2]) if len(sys.argv) > 2 else 30000
+    sys.exit(0 if run_harness(count, engine_count) else 1)